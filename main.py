@@ -1,9 +1,13 @@
 """
 The aim of this script is to retrieve all the GIS data about Italian roads available
 on OSM.
-For every value in the 'ref', 'nat_ref', 'name' tags 
- - a new layer is created
- - all matching segments are merged into it
+For every region, a single GeoParquet file <region>/roads.parquet is written:
+ - every segment is stored once, with its tags as columns (e.g. filter on ref == 'A1')
+ - the road_name column lists the distinct values of its name tags ('ref',
+   'nat_ref', 'name', ...)
+ - the highway type of the road is found in the road_class column
+ - nodes carrying relevant tags (barriers, restrictions, ...) are stored as points
+Setting CONSOLIDATED_OUTPUT = False writes one GeoJSON layer per road name instead.
 
  The tables are enriched with the tags
   - maxweight
@@ -11,19 +15,37 @@ For every value in the 'ref', 'nat_ref', 'name' tags
   - maxaxleload
   - roadowner
   - owner_id
+
+ Dependencies are listed in requirements.txt (pyarrow is needed by
+ GeoDataFrame.to_parquet).
  
  TODO 
     Implement functions for barriers (toll_booth)
  """
 import sys
 from pathlib import Path
-import overpy
-import json
+import requests
+from requests.adapters import HTTPAdapter
+import orjson
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from numba import njit
 import time
 import random
+import hashlib
+import tempfile
+import itertools
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 BASE_DIR = Path("/home/psc/Desktop/Portfolio/Trasporti_Eccezionali/DB/QGIS/script")
 
+# Raw Overpass responses are cached on disk and reused while fresh
+CACHE_DIR = BASE_DIR / ".overpass_cache"
+CACHE_TTL = 7 * 24 * 3600  # seconds
+
 # Relation ids to bound queries spatially
 regions = {
     'Sicilia': 39152,
@@ -64,6 +86,19 @@ name_tags = [
     'old_ref'
 ]
 
+# Set versions for membership tests against tag dicts
+NAME_TAGS = frozenset(name_tags)
+WAY_COLUMN_TAGS = NAME_TAGS | {'highway'}
+
+# Minified query fetching every highway class of interest in an area at once,
+# together with the nodes of the matching ways. Only area_id varies per call.
+HIGHWAY_QUERY_TEMPLATE = (
+    '[out:json][timeout:60];'
+    'area({area_id})->.searchArea;'
+    '(way["highway"~"^(' + '|'.join(highway_tags) + ')$"](area.searchArea);node(w););'
+    'out body;'
+)
+
 DEFAULT_TAGS = {
     'maxheight': None,
     'maxweight': None,
@@ -73,6 +108,33 @@ DEFAULT_TAGS = {
     'owner_id': None
 }
 
+# Nodes are written as Point features only if they carry one of these tags,
+# plain vertices are already part of the way LineStrings
+INTERESTING_NODE_TAGS = frozenset([
+    'highway',
+    'barrier',
+    'traffic_signals',
+    'toll',
+    *DEFAULT_TAGS
+]) | NAME_TAGS
+
+# FeatureCollection envelope written ahead of the streamed features
+GEOJSON_HEADER = (
+    b'{"type":"FeatureCollection",'
+    b'"crs":{"type":"name","properties":{"name":"urn:ogc:def:crs:OGC:1.3:CRS84"}},'
+    b'"features":[\n'
+)
+
+# Write a single GeoParquet file per region, with a road_name column, instead
+# of one GeoJSON file per (highway type, road name)
+CONSOLIDATED_OUTPUT = True
+
+# Write newline-delimited features (.geojsonl) instead of FeatureCollections
+LINE_DELIMITED_OUTPUT = False
+
+# Output is compact by default, set GEOJSON_INDENT=1 to pretty-print for debugging
+GEOJSON_DUMPS_OPTION = orjson.OPT_INDENT_2 if os.environ.get("GEOJSON_INDENT") else None
+
 OVERPASS_SERVERS = [
     "https://overpass-api.de/api/interpreter",
     "https://overpass.kumi.systems/api/interpreter",
@@ -80,173 +142,436 @@ OVERPASS_SERVERS = [
     "https://overpass.openstreetmap.fr/api/interpreter"
 ]
 
-def get_overpass_instance():
-    """Return an Overpass API instance with a random server"""
+# Overpass grants a handful of concurrent slots per IP, stay below the cap
+MAX_WORKERS = 3
+MAX_RETRIES = 3
+RETRY_DELAY = 15  # seconds, multiplied by the attempt number
+# (connect, read) timeouts in seconds, the read one above the query's [timeout:60]
+REQUEST_TIMEOUT = (10, 90)
+
+# One pooled keep-alive session shared by every worker thread
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=len(OVERPASS_SERVERS),
+                                      pool_maxsize=MAX_WORKERS + 1))
+
+def get_overpass_server():
+    """Return a random Overpass server URL"""
     server = random.choice(OVERPASS_SERVERS)
     print(f"[INFO] Using Overpass server: {server}")
-    return overpy.Overpass(url=server)
-
-def overpass_query(region, value):
-    api = get_overpass_instance()
-    query_region = f"""
-        [out:json][timeout:25];
-        area["ISO3166-1"="IT"][admin_level=2]->.italy;
-        relation(area.italy)["admin_level"="4"]["name"="{region}"]["boundary"="administrative"];
-        out ids;
-    """
-
-    # Extract the area ID for region
-    try:
-        result_region = api.query(query_region)
-        if not result_region.relations:
-            print(f"[WARNING] No relation found for region '{region}'")
-            return None
-        relation_id = result_region.relations[0].id
-    except Exception as e:
-        print(f"[ERROR] Failed to retrieve region '{region}': {e}")
-        return None
+    return server
 
+class OverpassResult:
+    """
+    Columnar view of an Overpass response.
+
+    Attributes:
+        ways (pd.DataFrame): One row per way with its 'id', the list of its
+            'nodes' ids, its 'tags' dict and one column per highway/name tag.
+        nodes (pd.DataFrame): Indexed by node id, with 'lon', 'lat', 'tags'
+            and one column per name tag.
+    """
+    def __init__(self, ways, nodes):
+        self.ways = ways
+        self.nodes = nodes
+
+class OverpassRuntimeError(Exception):
+    """Raised when Overpass answers with a remark instead of complete data"""
+
+def overpass_request(query):
+    """POST a query to Overpass and return the raw response body"""
+    for attempt in range(1, MAX_RETRIES + 1):
+        try:
+            response = SESSION.post(get_overpass_server(), data={"data": query},
+                                    timeout=REQUEST_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            print(f"[WARNING] Overpass unreachable ({e}), retrying in {RETRY_DELAY * attempt}s")
+            time.sleep(RETRY_DELAY * attempt)
+            continue
+        if response.status_code in (429, 504) and attempt < MAX_RETRIES:
+            print(f"[WARNING] Overpass busy (HTTP {response.status_code}), "
+                  f"retrying in {RETRY_DELAY * attempt}s")
+            time.sleep(RETRY_DELAY * attempt)
+            continue
+        response.raise_for_status()
+        return response.content
+
+def cached_query(query):
+    """Run an Overpass query, reusing a fresh on-disk response when available"""
+    key = hashlib.sha1(query.encode()).hexdigest()
+    cache_file = CACHE_DIR / f"{key}.json"
+
+    if cache_file.exists() and time.time() - cache_file.stat().st_mtime < CACHE_TTL:
+        with open(cache_file, "rb") as f:
+            try:
+                data = orjson.loads(f.read())
+            except orjson.JSONDecodeError:
+                data = None
+        if data is not None and "remark" not in data:
+            print(f"[INFO] Using cached response: {cache_file}")
+            return data
+        # Truncated or invalid entries (e.g. from an interrupted run) are refetched
+        print(f"[WARNING] Discarding invalid cached response: {cache_file}")
+        cache_file.unlink(missing_ok=True)
+
+    content = overpass_request(query)
+    data = orjson.loads(content)
+    # Overpass reports timeouts and out-of-memory errors as a remark in a 200
+    # response whose elements are partial or empty: never cache those
+    if "remark" in data:
+        raise OverpassRuntimeError(data["remark"])
+
+    # Write to a temporary file first so an interrupted run never leaves a
+    # partial cache entry behind
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix=".tmp", delete=False) as f:
+        f.write(content)
+    os.replace(f.name, cache_file)
+    return data
+
+def parse_elements(data):
+    """Parse the elements of an Overpass JSON response into an OverpassResult"""
+    way_columns = ['highway', *name_tags]
+    ways = []
+    nodes = []
+    for element in data["elements"]:
+        tags = element.get("tags", {})
+        # Only the tags actually present are copied, missing columns become NaN
+        if element["type"] == "way":
+            ways.append({
+                "id": element["id"],
+                "nodes": element["nodes"],
+                "tags": tags,
+                **{t: tags[t] for t in tags.keys() & WAY_COLUMN_TAGS}
+            })
+        elif element["type"] == "node":
+            nodes.append({
+                "id": element["id"],
+                "lon": element["lon"],
+                "lat": element["lat"],
+                "tags": tags,
+                **{t: tags[t] for t in tags.keys() & NAME_TAGS}
+            })
+
+    ways_df = pd.DataFrame(ways, columns=["id", "nodes", "tags", *way_columns])
+    nodes_df = pd.DataFrame(nodes, columns=["id", "lon", "lat", "tags", *name_tags])
+    nodes_df = nodes_df.set_index("id")
+    return OverpassResult(ways=ways_df, nodes=nodes_df)
+
+def overpass_query_all_highways(region):
     # The area ID for Overpass queries is 3600000000 + relation.id
-    area_id = 3600000000 + relation_id
+    area_id = 3600000000 + regions[region]
 
-    # Step 2: Query all primary highways in the region
-    query_highways = f"""
-    [out:json][timeout:60];
-    area({area_id})->.searchArea;
-    (
-        way["highway"="{value}"](area.searchArea);
-        node(w);
-    );
-    out body geom;
+    # Run the highway query, served from cache on repeated runs
+    return parse_elements(cached_query(HIGHWAY_QUERY_TEMPLATE.format(area_id=area_id)))
+
+def build_node_index(nodes):
     """
+    Store node ids and coordinates as id-sorted NumPy arrays (one per field).
 
-    # Run the highway query
-    result_highways = api.query(query_highways)
-    # overpy result object has to be serialized for geojson output
-    return result_highways
+    Returns:
+        tuple: (sorted_ids, sorted_lons, sorted_lats)
+    """
+    nodes = nodes.sort_index()
+    return (
+        nodes.index.to_numpy(dtype=np.int64),
+        nodes["lon"].to_numpy(dtype=np.float64),
+        nodes["lat"].to_numpy(dtype=np.float64),
+    )
+
+@njit(cache=True)
+def gather_coords(way_node_ids, way_offsets, sorted_ids, lons, lats,
+                  out_lons, out_lats, out_offsets):
+    """
+    Resolve the node ids of every way to coordinates in one compiled loop.
 
-def save_geojson(ways, nodes, filepath):
+    Ways are stored CSR-style: the ids of way i are
+    way_node_ids[way_offsets[i]:way_offsets[i + 1]]. Found coordinates are
+    written to out_lons/out_lats, and the coordinates of way i end up in
+    out_*[out_offsets[i]:out_offsets[i + 1]]. Ids missing from sorted_ids are skipped.
     """
-    Save a GeoJSON file with LineString features for ways and Point features for nodes.
-    
-    Args:
-        ways (list): A list of overpy.Way objects.
-        nodes (list): A list of overpy.Node objects.
-        filename (str or Path): File path for the output .geojson
+    n_ids = len(sorted_ids)
+    pos = 0
+    for i in range(len(way_offsets) - 1):
+        out_offsets[i] = pos
+        for j in range(way_offsets[i], way_offsets[i + 1]):
+            node_id = way_node_ids[j]
+            # Binary search for node_id in sorted_ids
+            lo = 0
+            hi = n_ids
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if sorted_ids[mid] < node_id:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo < n_ids and sorted_ids[lo] == node_id:
+                out_lons[pos] = lons[lo]
+                out_lats[pos] = lats[lo]
+                pos += 1
+    out_offsets[len(way_offsets) - 1] = pos
+
+def ways_coordinates(ways, node_index):
+    """Yield, for every way, the list of [lon, lat] pairs of its nodes found in node_index"""
+    sorted_ids, sorted_lons, sorted_lats = node_index
+    lengths = np.fromiter(map(len, ways["nodes"]), dtype=np.int64, count=len(ways))
+    way_offsets = np.zeros(len(ways) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=way_offsets[1:])
+    total = int(way_offsets[-1])
+    way_node_ids = np.fromiter(
+        itertools.chain.from_iterable(ways["nodes"]), dtype=np.int64, count=total
+    )
+
+    out_lons = np.empty(total, dtype=np.float64)
+    out_lats = np.empty(total, dtype=np.float64)
+    out_offsets = np.empty(len(ways) + 1, dtype=np.int64)
+    gather_coords(way_node_ids, way_offsets, sorted_ids, sorted_lons, sorted_lats,
+                  out_lons, out_lats, out_offsets)
+
+    coords = np.column_stack((out_lons, out_lats))
+    for i in range(len(ways)):
+        yield coords[out_offsets[i]:out_offsets[i + 1]].tolist()
+
+def iter_features(ways, nodes):
     """
-    features = []
+    Yield GeoJSON features one at a time: LineStrings for ways, Points for nodes.
 
-    # Build a dict of node_id → (lon, lat)
-    node_dict = {node.id: (float(node.lon), float(node.lat)) for node in nodes}
+    Args:
+        ways (pd.DataFrame): Ways, as in OverpassResult.ways.
+        nodes (pd.DataFrame): Nodes, as in OverpassResult.nodes.
+    """
+    node_index = build_node_index(nodes)
 
     # Process ways
-    for way in ways:
-        coords = [node_dict[node.id] for node in way.nodes if node.id in node_dict]
+    for way_tags, coords in zip(ways["tags"], ways_coordinates(ways, node_index)):
         if len(coords) < 2:
             continue 
 
-        tags = way.tags.copy()
-        tags.update({k: v for k, v in DEFAULT_TAGS.items() if k not in tags})
+        # Real tags override the defaults
+        tags = {**DEFAULT_TAGS, **way_tags}
 
-        features.append({
+        yield {
             "type": "Feature",
             "geometry": {
                 "type": "LineString",
                 "coordinates": coords
             },
             "properties": tags
-        })
+        }
 
-    # Process nodes (optional: only save those with tags or relevance)
-    for node in nodes:
-        tags = node.tags.copy()
-        tags.update({k: v for k, v in DEFAULT_TAGS.items() if k not in tags})
+    # Process nodes, skipping untagged vertices
+    for lon, lat, node_tags in zip(nodes["lon"].tolist(), nodes["lat"].tolist(), nodes["tags"]):
+        if not node_tags.keys() & INTERESTING_NODE_TAGS:
+            continue
+        tags = {**DEFAULT_TAGS, **node_tags}
 
-        features.append({
+        yield {
             "type": "Feature",
             "geometry": {
                 "type": "Point",
-                "coordinates": [float(node.lon), float(node.lat)]
+                "coordinates": [lon, lat]
             },
             "properties": tags
-        })
-
-    geojson = {
-        "type": "FeatureCollection",
-        "features": features,
-        "crs": {
-            "type": "name",
-            "properties": {
-                "name": "urn:ogc:def:crs:OGC:1.3:CRS84"
-            }
         }
-    }
 
-    with open(filepath, "w") as f:
-        json.dump(geojson, f, indent=2)
+def save_geojson(ways, nodes, filepath, line_delimited=False):
+    """
+    Save a GeoJSON file with LineString features for ways and Point features for nodes.
+    Features are serialized and written one at a time, so the whole collection
+    never has to be held in memory.
+    
+    Args:
+        ways (pd.DataFrame): Ways, as in OverpassResult.ways.
+        nodes (pd.DataFrame): Nodes, as in OverpassResult.nodes.
+        filename (str or Path): File path for the output .geojson
+        line_delimited (bool): Write one feature per line (.geojsonl) instead
+            of a FeatureCollection
+    """
+    with open(filepath, "wb") as f:
+        if line_delimited:
+            for feature in iter_features(ways, nodes):
+                f.write(orjson.dumps(feature, option=orjson.OPT_APPEND_NEWLINE))
+        else:
+            f.write(GEOJSON_HEADER)
+            first = True
+            for feature in iter_features(ways, nodes):
+                if not first:
+                    f.write(b",\n")
+                f.write(orjson.dumps(feature, option=GEOJSON_DUMPS_OPTION))
+                first = False
+            f.write(b"\n]}")
 
     print(f"[INFO] Saved: {filepath}")
 
 
 
-def find_names(overpass_result):
-    road_names = set()
-    for way in overpass_result.ways:
-        for tag in name_tags:
-            if tag in way.tags:
-                road_names.add(way.tags[tag])
-    return road_names
+def positions_by_name(df):
+    """
+    Map every value of the name tag columns of df to the positions of the rows
+    carrying it, with vectorized reshaping instead of nested loops.
+    """
+    values = df[name_tags].reset_index(drop=True)
+    long = values.melt(ignore_index=False, var_name="tag", value_name="value")["value"].dropna()
+    # A row tagged e.g. ref=A1 and nat_ref=A1 must be listed only once
+    pairs = pd.DataFrame({"row": long.index, "name": long.to_numpy()}).drop_duplicates()
+    pairs = pairs.sort_values("row", kind="stable")
+    return {
+        name: rows.to_numpy()
+        for name, rows in pairs.groupby("name", sort=False)["row"]
+    }
 
 
-def extract_roads(names, region, tag, result):
-    for name in names:
-        # Filter ways that have this name in any of the name tags
-        ways = []
-        for way in result.ways:
-            for name_tag in name_tags:
-                if name_tag in way.tags and way.tags[name_tag] == name:
-                    ways.append(way)
-                    break  # No need to check other tags if we found a match
-        if not ways:
-            continue
-        
-        # Get all nodes referenced by these ways
-        way_node_ids = set()
-        for way in ways:
-            way_node_ids.update(node.id for node in way.nodes)
-        
-        # Filter nodes that are either tagged with this name or part of these ways
-        nodes = []
-        for node in result.nodes:
-            # Include if it's part of any way with this name
-            if node.id in way_node_ids:
-                nodes.append(node)
-                continue
-            # Or if it's directly tagged with this name
-            for name_tag in name_tags:
-                if name_tag in getattr(node, 'tags', {}) and node.tags[name_tag] == name:
-                    nodes.append(node)
-                    break
+def group_ways_by_name(overpass_result):
+    """Group ways by every value found in their name tags."""
+    ways = overpass_result.ways
+    return {name: ways.iloc[rows] for name, rows in positions_by_name(ways).items()}
+
+
+def iter_road_layers(groups, result):
+    """
+    Yield (name, ways, nodes) for every road name, with only the columns
+    needed to build its features.
+    """
+    nodes_df = result.nodes
 
+    # Index name-tagged nodes once instead of scanning result.nodes for every name
+    tagged_nodes_by_name = {
+        name: nodes_df.index[rows] for name, rows in positions_by_name(nodes_df).items()
+    }
+
+    for name, ways in groups.items():
+        # Nodes that are either part of these ways or directly tagged with this name
+        node_ids = set(itertools.chain.from_iterable(ways["nodes"]))
+        node_ids.update(tagged_nodes_by_name.get(name, []))
+        positions = nodes_df.index.get_indexer(list(node_ids))
+        # Only the columns iter_features reads are shipped to the workers
+        nodes = nodes_df.iloc[positions[positions >= 0]][["lon", "lat", "tags"]]
+        yield name, ways[["nodes", "tags"]], nodes
+
+def extract_roads(groups, region, tag, result, executor=None):
+    """
+    Write one GeoJSON file per road name. When a process pool executor is
+    given, files are serialized and written by its workers in parallel.
+    """
+    futures = []
+
+    for name, ways, nodes in iter_road_layers(groups, result):
         # Save to file
         dir_path = BASE_DIR / Path(region) / tag
         safe_name = name.replace('/', '_').replace(' ', '_')
-        file_name = f"{safe_name}.geojson"
+        extension = "geojsonl" if LINE_DELIMITED_OUTPUT else "geojson"
+        file_name = f"{safe_name}.{extension}"
         file_path = dir_path / file_name
         dir_path.mkdir(parents=True, exist_ok=True)
-        save_geojson(ways, nodes, file_path)
+        if executor is None:
+            save_geojson(ways, nodes, file_path, LINE_DELIMITED_OUTPUT)
+        else:
+            futures.append(executor.submit(save_geojson, ways, nodes, file_path,
+                                           LINE_DELIMITED_OUTPUT))
 
-def main():
-    region = sys.argv[1]
+    # Surface errors raised in the workers
+    for future in futures:
+        future.result()
+
+def save_geoparquet(layers, filepath):
+    """
+    Save every road of a region into a single GeoParquet file, with one row
+    per way and per relevant node. Rows keep their tags (including the name
+    tags, e.g. ref) plus a road_class column and a road_name list column
+    holding every distinct name tag value.
+
+    Args:
+        layers (dict): highway tag -> (ways, nodes) DataFrames, restricted to
+            the columns iter_features reads.
+        filepath (str or Path): File path for the output .parquet
+    """
+    def iter_rows():
+        for tag, (ways, nodes) in layers.items():
+            for feature in iter_features(ways, nodes):
+                properties = feature["properties"]
+                properties["road_class"] = tag
+                properties["road_name"] = list(dict.fromkeys(
+                    properties[t] for t in name_tags if t in properties
+                ))
+                yield feature
+
+    gdf = gpd.GeoDataFrame.from_features(iter_rows(), crs="OGC:CRS84")
+    gdf.to_parquet(filepath)
+
+    print(f"[INFO] Saved: {filepath}")
+
+def save_region(region, layers, executor=None):
+    """Write the roads of all highway layers of a region to one file"""
+    frames = {
+        tag: (sub_network.ways[["nodes", "tags"]], sub_network.nodes[["lon", "lat", "tags"]])
+        for tag, sub_network in layers.items()
+        if len(sub_network.ways)
+    }
+    if not frames:
+        print(f"[WARNING] No roads found for region '{region}'")
+        return
+
+    dir_path = BASE_DIR / Path(region)
+    dir_path.mkdir(parents=True, exist_ok=True)
+    file_path = dir_path / "roads.parquet"
+    if executor is None:
+        save_geoparquet(frames, file_path)
+    else:
+        executor.submit(save_geoparquet, frames, file_path).result()
+
+def split_by_highway(result):
+    """
+    Split a combined query result into one OverpassResult per highway tag.
+    Each layer only keeps the nodes referenced by its own ways, as a per-tag
+    query would have returned.
+    """
+    layers = {}
     for tag in highway_tags:
+        ways = result.ways[result.ways["highway"] == tag]
+        node_ids = np.unique(np.fromiter(
+            itertools.chain.from_iterable(ways["nodes"]), dtype=np.int64
+        ))
+        positions = result.nodes.index.get_indexer(node_ids)
+        nodes = result.nodes.iloc[positions[positions >= 0]]
+        layers[tag] = OverpassResult(ways=ways, nodes=nodes)
+    return layers
+
+def fetch_and_process(region, executor=None):
+    """Download the road network of a region and write its layers to disk"""
+    print(f"[INFO] Processing region '{region}'")
+    road_network = overpass_query_all_highways(region)
+    layers = split_by_highway(road_network)
+    if CONSOLIDATED_OUTPUT:
+        save_region(region, layers, executor)
+        return
+    for tag, sub_network in layers.items():
         print(f"[INFO] Processing region '{region}', highway type '{tag}'")
-        road_network = overpass_query(region, tag)
-        if road_network is None:
-            continue
-        road_names = find_names(road_network)
-        extract_roads(road_names, region, tag, road_network)
-        time.sleep(5)
-    time.sleep(15)
+        road_groups = group_ways_by_name(sub_network)
+        extract_roads(road_groups, region, tag, sub_network, executor)
+
+def main():
+    # Regions can be passed on the command line, otherwise all of them are processed
+    selected = sys.argv[1:] or list(regions)
+    for region in selected:
+        if region not in regions:
+            print(f"[WARNING] Unknown region '{region}', expected one of: {', '.join(regions)}")
+    selected = [region for region in selected if region in regions]
+    # Output serialization is CPU-bound and runs in separate processes. Workers
+    # are spawned rather than forked since the download threads are already running.
+    writers = ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                  mp_context=multiprocessing.get_context("spawn"))
+    with writers, ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(fetch_and_process, region, writers): region
+            for region in selected
+        }
+        for future in as_completed(futures):
+            region = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"[ERROR] Failed to process region '{region}': {e}")
 
 
 if __name__ == "__main__":